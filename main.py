@@ -1,7 +1,11 @@
-import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import orjson
+import pandas as pd
+from numba import njit
 import streamlit as st
-from collections import defaultdict
 import base64
 
 ALLOWED_LABELS = {
@@ -24,23 +28,59 @@ ALLOWED_LABELS = {
     "ulcer",
 }
 
+LABELS = sorted(ALLOWED_LABELS)
+LABEL_ID = {l: i for i, l in enumerate(LABELS)}
 
-def tiou(a, b):
-    inter = max(0, min(a["end"], b["end"]) - max(a["start"], b["start"]) + 1)
-    union = (a["end"] - a["start"] + 1) + (b["end"] - b["start"] + 1) - inter
-    return inter / union if union > 0 else 0.0
+EMPTY = np.empty((0, 2), dtype=np.int64)
+
+# Counted in overlapping (prediction, GT) candidate pairs. Below roughly half a
+# second of serial matching work, worker dispatch and pickling cost more than
+# they save.
+PARALLEL_MIN_PAIRS = 10_000_000
 
 
 def extract_by_video_label(data):
-    out = defaultdict(lambda: defaultdict(list))
+    vid_code = {}
     for v in data["videos"]:
-        vid = v["video_id"]
-        for e in v["events"]:
-            for lbl in e["label"]:
-                out[vid][lbl].append({"start": e["start"], "end": e["end"]})
+        vid_code.setdefault(v["video_id"], len(vid_code))
+
+    entries = [
+        (vid_code[v["video_id"]], LABEL_ID[l], e["start"], e["end"], e.get("score", 1.0))
+        for v in data["videos"]
+        for e in v["events"]
+        for l in e["label"]
+        if l in LABEL_ID
+    ]
+    if not entries:
+        return {}
+
+    vi, li, starts, ends, scores = (np.asarray(c) for c in zip(*entries))
+    order = np.lexsort((-scores, li, vi))
+    keys = (vi * len(LABELS) + li)[order]
+    segs = np.column_stack((starts, ends))[order]
+
+    vids = list(vid_code)
+    keys, first = np.unique(keys, return_index=True)
+    out = {}
+    for key, a, b in zip(keys, first, np.append(first[1:], len(segs))):
+        v, lbl = divmod(int(key), len(LABELS))
+        out.setdefault(vids[v], {})[lbl] = segs[a:b]
     return out
 
 
+@st.cache_resource
+def _load_gt():
+    gt_b64 = os.environ.get("GROUND_TRUTH_JSON_BASE64")
+    if not gt_b64:
+        return None
+    return orjson.loads(base64.b64decode(gt_b64))
+
+
+@st.cache_resource
+def _gt_index():
+    return extract_by_video_label(_load_gt())
+
+
 def sanity_check(gt, pred):
     gt_ids = {v["video_id"] for v in gt["videos"]}
     pr_ids = {v["video_id"] for v in pred["videos"]}
@@ -55,39 +95,73 @@ def sanity_check(gt, pred):
             msg += f" Extra in prediction: {extra}."
         return False, msg
 
-    for v in pred["videos"]:
-        for e in v["events"]:
-            for l in e["label"]:
-                if l not in ALLOWED_LABELS:
-                    return False, f"Invalid label '{l}' in video '{v['video_id']}'."
+    all_labels = {l for v in pred["videos"] for e in v["events"] for l in e["label"]}
+    bad = all_labels - ALLOWED_LABELS
+    if bad:
+        return False, f"Invalid label(s): {bad}."
+
+    bad_score_vids = {
+        v["video_id"]
+        for v in pred["videos"]
+        for e in v["events"]
+        if "score" in e
+        and (isinstance(e["score"], bool) or not isinstance(e["score"], (int, float)))
+    }
+    if bad_score_vids:
+        return False, f"Non-numeric score in video(s): {bad_score_vids}."
+
+    bad_bound_vids = {
+        v["video_id"]
+        for v in pred["videos"]
+        for e in v["events"]
+        if any(isinstance(e[k], bool) or not isinstance(e[k], int) for k in ("start", "end"))
+    }
+    if bad_bound_vids:
+        return False, f"Non-integer start/end in video(s): {bad_bound_vids}."
 
     return True, "All checks passed"
 
 
-def average_precision(gt_segs, pr_segs, thr):
-    matched = set()
-    tp = []
-    for p in pr_segs:
-        hit = False
-        for i, g in enumerate(gt_segs):
-            if i in matched:
+@st.cache_data
+def _check_predictions(raw):
+    pr = orjson.loads(raw)
+    passed, message = sanity_check(_load_gt(), pr)
+    return passed, message, extract_by_video_label(pr) if passed else None
+
+
+@njit(cache=True)
+def _match(indptr, cols, vals, n_gt, thr):
+    n_pr = indptr.shape[0] - 1
+    used = np.zeros(n_gt, dtype=np.bool_)
+    tp = np.zeros(n_pr, dtype=np.bool_)
+
+    for i in range(n_pr):
+        best = -1
+        best_iou = -1.0
+        for k in range(indptr[i], indptr[i + 1]):
+            j = cols[k]
+            iou = vals[k]
+            if used[j] or iou < thr:
                 continue
-            if tiou(p, g) >= thr:
-                matched.add(i)
-                hit = True
-                break
-        tp.append(1 if hit else 0)
+            if iou > best_iou or (iou == best_iou and j < best):
+                best = j
+                best_iou = iou
+        if best >= 0:
+            used[best] = True
+            tp[i] = True
 
-    if not gt_segs:
-        return 0.0 if pr_segs else 1.0
+    return tp
 
-    cum_tp = 0
+
+@njit(cache=True)
+def _ap_core(tp, n_gt):
+    cum_tp = np.int32(0)
     prev_r = 0.0
     ap = 0.0
 
-    for i, v in enumerate(tp):
-        cum_tp += v
-        r = cum_tp / len(gt_segs)
+    for i in range(tp.shape[0]):
+        cum_tp = np.int32(cum_tp + tp[i])
+        r = cum_tp / n_gt
         p = cum_tp / (i + 1)
         ap += p * (r - prev_r)
         prev_r = r
@@ -95,24 +169,85 @@ def average_precision(gt_segs, pr_segs, thr):
     return ap
 
 
-def compute_video_maps(gt, pr, thr):
-    gt_ev = extract_by_video_label(gt)
-    pr_ev = extract_by_video_label(pr)
-    video_maps = {}
+def _candidate_windows(gt_segs, pr_segs):
+    # Sort GT by start and keep a running max of ends, so each prediction's
+    # candidate GT segments form one contiguous window [lo, hi).
+    order = np.argsort(gt_segs[:, 0], kind="stable")
+    gt_s, gt_e = gt_segs[order, 0], gt_segs[order, 1]
+
+    lo = np.searchsorted(np.maximum.accumulate(gt_e), pr_segs[:, 0], side="left")
+    hi = np.maximum(np.searchsorted(gt_s, pr_segs[:, 1], side="right"), lo)
+    return order, gt_s, gt_e, lo, hi
+
+
+def _candidate_pairs(gt_segs, pr_segs):
+    _, _, _, lo, hi = _candidate_windows(gt_segs, pr_segs)
+    return int((hi - lo).sum())
+
+
+def _tiou_matrix(gt_segs, pr_segs):
+    # Sparse CSR layout: row i holds the tIoUs of prediction i against its
+    # candidate window, with cols mapped back to the original GT indices.
+    order, gt_s, gt_e, lo, hi = _candidate_windows(gt_segs, pr_segs)
+    counts = hi - lo
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+
+    rows = np.repeat(np.arange(len(pr_segs)), counts)
+    cols = lo[rows] + np.arange(len(rows)) - indptr[rows]
+
+    ps, pe = pr_segs[rows, 0], pr_segs[rows, 1]
+    gs, ge = gt_s[cols], gt_e[cols]
+    inter = np.maximum(0, np.minimum(pe, ge) - np.maximum(ps, gs) + 1)
+    union = (pe - ps + 1) + (ge - gs + 1) - inter
 
-    for vid in gt_ev:
-        aps = []
-        for lbl in ALLOWED_LABELS:
-            aps.append(
-                average_precision(
-                    gt_ev[vid].get(lbl, []),
-                    pr_ev[vid].get(lbl, []),
-                    thr,
-                )
-            )
-        video_maps[vid] = sum(aps) / len(aps)
+    vals = np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+    return indptr, order[cols], vals
 
-    return video_maps
+
+def average_precision(gt_segs, pr_segs, thrs):
+    if len(gt_segs) == 0:
+        return {thr: 0.0 if len(pr_segs) else 1.0 for thr in thrs}
+
+    indptr, cols, vals = _tiou_matrix(gt_segs, pr_segs)
+
+    aps = {}
+    for thr in thrs:
+        tp = _match(indptr, cols, vals, len(gt_segs), thr)
+        aps[thr] = float(_ap_core(tp, len(gt_segs)))
+
+    return aps
+
+
+@st.cache_resource
+def _executor():
+    return ProcessPoolExecutor(os.cpu_count())
+
+
+def compute_video_maps(gt_ev, pr_ev, thrs):
+    vids = list(gt_ev)
+    jobs = [
+        (vi, li, gt_ev[vid].get(li, EMPTY), pr_ev.get(vid, {}).get(li, EMPTY))
+        for vi, vid in enumerate(vids)
+        for li in range(len(LABELS))
+    ]
+
+    gt_segs = [g for _, _, g, _ in jobs]
+    pr_segs = [pr for _, _, _, pr in jobs]
+    pairs = sum(map(_candidate_pairs, gt_segs, pr_segs))
+
+    if (os.cpu_count() or 1) > 1 and pairs >= PARALLEL_MIN_PAIRS:
+        results = _executor().map(
+            average_precision, gt_segs, pr_segs, repeat(thrs), chunksize=len(LABELS)
+        )
+    else:
+        results = map(average_precision, gt_segs, pr_segs, repeat(thrs))
+
+    ap_mat = np.zeros((len(thrs), len(vids), len(LABELS)))
+    for (vi, li, _, _), aps in zip(jobs, results):
+        for t, thr in enumerate(thrs):
+            ap_mat[t, vi, li] = aps[thr]
+
+    return vids, ap_mat.mean(axis=2)
 
 
 st.title("ICPR 2026 RARE-VISION TEMPORAL mAP EVALUATOR")
@@ -165,33 +300,29 @@ Using the scripts provided in the official GitHub repository, you can automatica
 
    `videos → events → start, end, label`
 
+   An optional numeric `score` per event is used to rank predictions by confidence; events without one keep their order in the file. `start` and `end` must be integer frame indices.
+
 This JSON format is mandatory for evaluation in the ICPR 2026 RARE-VISION competition.
 """)
 
 
-gt_b64 = os.environ.get("GROUND_TRUTH_JSON_BASE64")
-if gt_b64:
-    gt = json.loads(base64.b64decode(gt_b64).decode())
-else:
+gt = _load_gt()
+if gt is None:
     st.error("GROUND_TRUTH_JSON_BASE64 environment variable not set.")
-    gt = None
 
 pred_file = st.file_uploader("Upload prediction JSON", type=["json"])
 
 if pred_file and gt:
-    pr = json.load(pred_file)
-    passed, message = sanity_check(gt, pr)
+    passed, message, pr_ev = _check_predictions(pred_file.getvalue())
 
     if not passed:
         st.error(message)
     else:
         st.success(message)
 
-        maps_05 = compute_video_maps(gt, pr, 0.5)
-        maps_095 = compute_video_maps(gt, pr, 0.95)
-
-        avg_05 = sum(maps_05.values()) / len(maps_05) if maps_05 else 0.0
-        avg_095 = sum(maps_095.values()) / len(maps_095) if maps_095 else 0.0
+        gt_ev = _gt_index()
+        vids, video_maps = compute_video_maps(gt_ev, pr_ev, (0.5, 0.95))
+        avg_05, avg_095 = video_maps.mean(axis=1).tolist() if vids else (0.0, 0.0)
 
         st.subheader("Overall Averages")
         col1, col2 = st.columns(2)
@@ -200,12 +331,11 @@ if pred_file and gt:
 
         st.subheader("Per-Video mAP Breakdown")
 
-        results = []
-        for vid in sorted(maps_05.keys()):
-            results.append({
-                "Video ID": vid,
-                "mAP @ 0.5": round(maps_05[vid], 4),
-                "mAP @ 0.95": round(maps_095[vid], 4)
-            })
+        rounded = video_maps.round(4)
+        df = pd.DataFrame({
+            "Video ID": vids,
+            "mAP @ 0.5": rounded[0],
+            "mAP @ 0.95": rounded[1],
+        }).sort_values("Video ID", ignore_index=True)
 
-        st.dataframe(results, use_container_width=True)
+        st.dataframe(df, use_container_width=True)